@@ -4,12 +4,19 @@ from __future__ import annotations
 import argparse
 import csv
 import json
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any
 from urllib.parse import urlparse
 
+try:
+    import orjson
+except ImportError:  # Optional speedup; stdlib json is the fallback.
+    orjson = None
+
 
 def build_legacy_token() -> str:
     return "i" + "biz"
@@ -22,6 +29,29 @@ def build_legacy_tokens() -> list[str]:
     ]
 
 
+# Tokens are plain ASCII lowercase, so a substring probe on `str.lower()` is a safe pre-filter
+# only as long as the legacy regex folds case in ASCII only (see `build_legacy_re`).
+_LEGACY_LOWER = tuple(build_legacy_tokens())
+_LEGACY_LOWER_BYTES = tuple(token.encode("ascii") for token in _LEGACY_LOWER)
+
+# Top-level company fields that `rewrite_company` fully cleans itself; the generic walk skips them.
+HANDLED_KEYS = frozenset({"source_id", "source_url", "logo_url", "websites"})
+
+# JSON `\uXXXX` escapes of ASCII letters could spell a token that a raw-line probe would miss.
+_ASCII_ESCAPE_RE = re.compile(rb"\\u00[4-7][0-9a-f]", flags=re.IGNORECASE)
+
+JSONL_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Integers this long may not fit in 64 bits.
+_LONG_DIGITS_RE = re.compile(rb"\d{19}")
+
+
+def build_legacy_re() -> re.Pattern[str]:
+    # Single alternation so each string is scanned once for all tokens. ASCII-only case folding
+    # keeps matches identical to the `str.lower()` substring checks (no `ı`/`İ`/`ſ` folding).
+    return re.compile("|".join(re.escape(token) for token in build_legacy_tokens()), flags=re.IGNORECASE | re.ASCII)
+
+
 @dataclass(frozen=True)
 class RewriteConfig:
     site_base_url: str
@@ -29,24 +59,22 @@ class RewriteConfig:
     catalog_path_prefix: str
 
 
-def contains_any_legacy_token(text: str, legacy_tokens: list[str]) -> bool:
-    low = (text or "").lower()
-    return any(token in low for token in legacy_tokens)
+def contains_any_legacy_token(text: str, legacy_re: re.Pattern[str]) -> bool:
+    return bool(text) and legacy_re.search(text) is not None
 
 
-def replace_legacy_tokens(text: str, legacy_token_res: list[re.Pattern[str]]) -> str:
-    out = text or ""
-    for pattern in legacy_token_res:
-        out = pattern.sub("biznesinfo", out)
-    return out
+def replace_legacy_tokens(text: str, legacy_re: re.Pattern[str]) -> str:
+    if not text:
+        return text or ""
+    return legacy_re.sub("biznesinfo", text)
 
 
-def normalize_logo_url(raw: str, legacy_tokens: list[str], legacy_token_res: list[re.Pattern[str]]) -> str:
+def normalize_logo_url(raw: str, legacy_re: re.Pattern[str]) -> str:
     value = (raw or "").strip()
     if not value:
         return ""
 
-    if not contains_any_legacy_token(value, legacy_tokens):
+    if not contains_any_legacy_token(value, legacy_re):
         return value
 
     # Keep only the pathname portion; upstream host should not be stored in exports.
@@ -58,44 +86,88 @@ def normalize_logo_url(raw: str, legacy_tokens: list[str], legacy_token_res: lis
         pass
 
     value = value.split("?", 1)[0].split("#", 1)[0].strip()
-    if contains_any_legacy_token(value, legacy_tokens):
-        value = replace_legacy_tokens(value, legacy_token_res)
+    if contains_any_legacy_token(value, legacy_re):
+        value = replace_legacy_tokens(value, legacy_re)
 
     return value
 
 
-def deep_rewrite(obj: Any, legacy_tokens: list[str], legacy_token_res: list[re.Pattern[str]]) -> Any:
+def loads_json(raw: bytes) -> tuple[Any, bool]:
+    # Also reports whether orjson parsed the value: only then can orjson re-encode it faithfully.
+    # orjson turns integers beyond 64 bits into floats, so lines with long digit runs go to stdlib.
+    if orjson is not None and _LONG_DIGITS_RE.search(raw) is None:
+        try:
+            return orjson.loads(raw), True
+        except orjson.JSONDecodeError:
+            pass  # stdlib still accepts NaN/Infinity, which orjson rejects.
+    return json.loads(raw), False
+
+
+def dumps_json_line(obj: Any, *, use_orjson: bool) -> bytes:
+    # orjson would silently write NaN/Infinity from stdlib-parsed lines as null, so those stay on stdlib.
+    if use_orjson and orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def raw_line_may_contain_legacy_token(raw: bytes) -> bool:
+    low = raw.lower()
+    if any(token in low for token in _LEGACY_LOWER_BYTES):
+        return True
+    return b"\\u" in raw and _ASCII_ESCAPE_RE.search(raw) is not None
+
+
+def deep_rewrite(obj: Any, legacy_re: re.Pattern[str], skip_keys: frozenset[str] = frozenset()) -> Any:
     if isinstance(obj, str):
-        if contains_any_legacy_token(obj, legacy_tokens):
-            return replace_legacy_tokens(obj, legacy_token_res)
-        return obj
+        low = obj.lower()
+        if not any(token in low for token in _LEGACY_LOWER):
+            return obj
+        return legacy_re.sub("biznesinfo", obj)
+    # Containers are rewritten in place so clean records do not get copied on every walk.
     if isinstance(obj, list):
-        return [deep_rewrite(item, legacy_tokens, legacy_token_res) for item in obj]
+        for i, item in enumerate(obj):
+            new_item = deep_rewrite(item, legacy_re)
+            if new_item is not item:
+                obj[i] = new_item
+        return obj
     if isinstance(obj, dict):
-        return {k: deep_rewrite(v, legacy_tokens, legacy_token_res) for k, v in obj.items()}
+        for k, v in obj.items():
+            if k in skip_keys:
+                continue
+            new_v = deep_rewrite(v, legacy_re)
+            if new_v is not v:
+                obj[k] = new_v
+        return obj
     return obj
 
 
-def rewrite_company(company: dict[str, Any], cfg: RewriteConfig, legacy_tokens: list[str], legacy_token_res: list[re.Pattern[str]]) -> dict[str, Any]:
-    source = (company.get("source") or "").strip().lower()
-    if source in legacy_tokens:
+def rewrite_company(company: dict[str, Any], cfg: RewriteConfig, legacy_re: re.Pattern[str], *, walk: bool = True) -> dict[str, Any]:
+    source = (company.get("source") or "").strip()
+    if legacy_re.fullmatch(source):
         company["source"] = "biznesinfo"
 
     source_id = (company.get("source_id") or "").strip()
-    if source_id and contains_any_legacy_token(source_id, legacy_tokens):
-        company["source_id"] = replace_legacy_tokens(source_id, legacy_token_res)
+    if source_id and contains_any_legacy_token(source_id, legacy_re):
+        company["source_id"] = replace_legacy_tokens(source_id, legacy_re)
         source_id = company["source_id"]
 
     if (company.get("source") or "").strip() == "biznesinfo" and source_id:
         company["source_url"] = f"{cfg.company_path_prefix}/{source_id}"
-    elif contains_any_legacy_token((company.get("source_url") or "").strip(), legacy_tokens):
+    elif contains_any_legacy_token((company.get("source_url") or "").strip(), legacy_re):
         company["source_url"] = ""
 
-    company["logo_url"] = normalize_logo_url(str(company.get("logo_url") or ""), legacy_tokens, legacy_token_res)
+    company["logo_url"] = normalize_logo_url(str(company.get("logo_url") or ""), legacy_re)
 
     websites = company.get("websites")
     if isinstance(websites, list):
-        company["websites"] = [w for w in websites if isinstance(w, str) and not contains_any_legacy_token(w, legacy_tokens)]
+        # Most lists are already clean; only rebuild when something would be dropped.
+        if any(not isinstance(w, str) or contains_any_legacy_token(w, legacy_re) for w in websites):
+            company["websites"] = [w for w in websites if isinstance(w, str) and not contains_any_legacy_token(w, legacy_re)]
+    elif "websites" in company:
+        company["websites"] = deep_rewrite(websites, legacy_re)
 
     categories = company.get("categories")
     if isinstance(categories, list):
@@ -104,7 +176,9 @@ def rewrite_company(company: dict[str, Any], cfg: RewriteConfig, legacy_tokens:
                 continue
             slug = (cat.get("slug") or "").strip()
             if slug:
-                cat["url"] = f"{cfg.catalog_path_prefix}/{slug}"
+                url = f"{cfg.catalog_path_prefix}/{slug}"
+                if cat.get("url") != url:
+                    cat["url"] = url
 
     rubrics = company.get("rubrics")
     if isinstance(rubrics, list):
@@ -113,35 +187,46 @@ def rewrite_company(company: dict[str, Any], cfg: RewriteConfig, legacy_tokens:
                 continue
             slug = (rub.get("slug") or "").strip()
             if slug:
-                rub["url"] = f"{cfg.catalog_path_prefix}/{slug}"
+                url = f"{cfg.catalog_path_prefix}/{slug}"
+                if rub.get("url") != url:
+                    rub["url"] = url
 
-    company = deep_rewrite(company, legacy_tokens, legacy_token_res)
+    # Categories/rubrics only get their URLs rebuilt above; names and other free-form fields still need the walk.
+    if walk:
+        company = deep_rewrite(company, legacy_re, skip_keys=HANDLED_KEYS)
     return company
 
 
-def rewrite_jsonl_file(src: Path, dst: Path, cfg: RewriteConfig, legacy_tokens: list[str], legacy_token_res: list[re.Pattern[str]]) -> None:
+def rewrite_jsonl_file(src: Path, dst: Path, cfg: RewriteConfig, legacy_re: re.Pattern[str]) -> None:
     dst.parent.mkdir(parents=True, exist_ok=True)
-    with src.open("r", encoding="utf-8") as fin, dst.open("w", encoding="utf-8", newline="\n") as fout:
+    # Rebuilt URLs are the only strings not taken from the input line.
+    cfg_clean = not contains_any_legacy_token(f"{cfg.company_path_prefix} {cfg.catalog_path_prefix}", legacy_re)
+    # Binary I/O: orjson parses the UTF-8 line bytes directly, skipping a decode/encode round trip.
+    with src.open("rb", buffering=JSONL_BUFFER_SIZE) as fin, dst.open("wb", buffering=JSONL_BUFFER_SIZE) as fout:
         for line in fin:
             raw = line.strip()
             if not raw:
                 continue
 
             try:
-                obj = json.loads(raw)
+                obj, parsed_by_orjson = loads_json(raw)
             except Exception:
                 continue
 
+            # Clean lines (the common case) only need the structural rewrites, not the token walk.
+            dirty = not cfg_clean or raw_line_may_contain_legacy_token(raw)
             if isinstance(obj, dict):
-                obj = rewrite_company(obj, cfg, legacy_tokens, legacy_token_res)
-            obj_line = json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+                obj = rewrite_company(obj, cfg, legacy_re, walk=dirty)
+            obj_line = dumps_json_line(obj, use_orjson=parsed_by_orjson)
 
             # Final guard: never emit legacy tokens.
-            if contains_any_legacy_token(obj_line, legacy_tokens):
-                obj_line = replace_legacy_tokens(obj_line, legacy_token_res)
+            if dirty:
+                text = obj_line.decode("utf-8")
+                if contains_any_legacy_token(text, legacy_re):
+                    obj_line = replace_legacy_tokens(text, legacy_re).encode("utf-8")
 
             fout.write(obj_line)
-            fout.write("\n")
+            fout.write(b"\n")
 
 
 def company_url_for_subdomain(subdomain: str, cfg: RewriteConfig) -> str:
@@ -152,54 +237,97 @@ def company_url_for_subdomain(subdomain: str, cfg: RewriteConfig) -> str:
     return f"{base}{cfg.company_path_prefix}/{sub}"
 
 
-def rewrite_csv_file(src: Path, dst: Path, cfg: RewriteConfig, legacy_tokens: list[str], legacy_token_res: list[re.Pattern[str]]) -> None:
+def rewrite_csv_file(src: Path, dst: Path, cfg: RewriteConfig, legacy_re: re.Pattern[str]) -> None:
     dst.parent.mkdir(parents=True, exist_ok=True)
     with src.open("r", encoding="utf-8", newline="") as fin:
-        reader = csv.DictReader(fin)
-        if not reader.fieldnames:
+        # Positional rows: the header is fixed per file, so column indexes are resolved once.
+        reader = csv.reader(fin)
+        header = next(reader, None)
+        if not header:
             return
+        width = len(header)
+        idx = {name: i for i, name in enumerate(header)}
+        sub_i = idx.get("subdomain")
+        url_idxs = [idx[name] for name in ("url", "company_url") if name in idx]
 
         with dst.open("w", encoding="utf-8", newline="") as fout:
-            writer = csv.DictWriter(fout, fieldnames=reader.fieldnames, lineterminator="\n")
-            writer.writeheader()
+            writer = csv.writer(fout, lineterminator="\n")
+            writer.writerow(header)
 
             for row in reader:
-                subdomain = (row.get("subdomain") or "").strip()
-                if subdomain and contains_any_legacy_token(subdomain, legacy_tokens):
-                    row["subdomain"] = replace_legacy_tokens(subdomain, legacy_token_res)
-                    subdomain = row["subdomain"]
-                if subdomain:
-                    if "url" in row:
-                        row["url"] = company_url_for_subdomain(subdomain, cfg)
-                    if "company_url" in row:
-                        row["company_url"] = company_url_for_subdomain(subdomain, cfg)
-
-                for key, value in list(row.items()):
-                    if not isinstance(value, str):
-                        continue
-                    if contains_any_legacy_token(value, legacy_tokens):
-                        row[key] = replace_legacy_tokens(value, legacy_token_res)
-
-                writer.writerow(row)
-
-
-def rewrite_directory(input_dir: Path, output_dir: Path, cfg: RewriteConfig, legacy_tokens: list[str], legacy_token_res: list[re.Pattern[str]]) -> None:
+                if not row:
+                    continue
+                if len(row) < width:
+                    row.extend([""] * (width - len(row)))
+                elif len(row) > width:
+                    raise ValueError(f"{src}: row has {len(row)} fields, header has {width}")
+
+                subdomain = row[sub_i].strip() if sub_i is not None else ""
+                if subdomain and contains_any_legacy_token(subdomain, legacy_re):
+                    subdomain = replace_legacy_tokens(subdomain, legacy_re)
+                    row[sub_i] = subdomain
+                if subdomain and url_idxs:
+                    company_url = company_url_for_subdomain(subdomain, cfg)
+                    for i in url_idxs:
+                        row[i] = company_url
+
+                # One scan over the whole row; the per-cell pass only runs for rows that have a hit.
+                # Tokens contain no NUL, so a match cannot straddle two cells.
+                if contains_any_legacy_token("\0".join(row), legacy_re):
+                    for i, value in enumerate(row):
+                        if contains_any_legacy_token(value, legacy_re):
+                            row[i] = replace_legacy_tokens(value, legacy_re)
+
+                # Fast path for rows that need no quoting (no delimiter, quote or line break in any cell):
+                # emit the joined line directly and leave quoting to csv.writer otherwise.
+                line = ",".join(row)
+                if line and line.count(",") == len(row) - 1 and '"' not in line and "\n" not in line and "\r" not in line:
+                    fout.write(line)
+                    fout.write("\n")
+                else:
+                    writer.writerow(row)
+
+
+def rewrite_export_file(task: tuple[str, Path, Path, RewriteConfig, str, int]) -> None:
+    # Runs in worker processes: the pattern is recompiled from its source/flags there.
+    kind, src, dst, cfg, pattern, flags = task
+    legacy_re = re.compile(pattern, flags)
+    if kind == "jsonl":
+        rewrite_jsonl_file(src, dst, cfg, legacy_re)
+    else:
+        rewrite_csv_file(src, dst, cfg, legacy_re)
+
+
+def rewrite_directory(input_dir: Path, output_dir: Path, cfg: RewriteConfig, legacy_re: re.Pattern[str], workers: int = 0) -> None:
     if not input_dir.is_dir():
         raise SystemExit(f"Input directory not found: {input_dir}")
 
     output_dir.mkdir(parents=True, exist_ok=True)
-    for entry in sorted(input_dir.iterdir()):
+    with os.scandir(input_dir) as it:
+        entries = sorted(it, key=lambda e: e.name)
+
+    tasks: list[tuple[str, Path, Path, RewriteConfig, str, int]] = []
+    for entry in entries:
         if not entry.is_file():
             continue
-        if entry.suffix == ".jsonl":
-            rewrite_jsonl_file(entry, output_dir / entry.name, cfg, legacy_tokens, legacy_token_res)
-            continue
-        if entry.suffix == ".csv":
-            rewrite_csv_file(entry, output_dir / entry.name, cfg, legacy_tokens, legacy_token_res)
+        name = entry.name
+        suffix = os.path.splitext(name)[1]
+        if suffix in (".jsonl", ".csv"):
+            tasks.append((suffix[1:], Path(entry.path), output_dir / name, cfg, legacy_re.pattern, legacy_re.flags))
             continue
 
         # Unknown file type: copy as-is (best effort).
-        (output_dir / entry.name).write_bytes(entry.read_bytes())
+        (output_dir / name).write_bytes(Path(entry.path).read_bytes())
+
+    # Shards are independent; spread them over processes when there is more than one.
+    max_workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if max_workers <= 1:
+        for task in tasks:
+            rewrite_export_file(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        list(ex.map(rewrite_export_file, tasks))
 
 
 def main() -> None:
@@ -209,6 +337,7 @@ def main() -> None:
     parser.add_argument("--site-base-url", default="https://biznesinfo.lucheestiy.com", help="Base site URL for CSV company links.")
     parser.add_argument("--company-path-prefix", default="/company", help="Company path prefix (for source_url + CSV links).")
     parser.add_argument("--catalog-path-prefix", default="/catalog", help="Catalog path prefix for categories/rubrics.")
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes for rewriting shards (0 = CPU count).")
     args = parser.parse_args()
 
     cfg = RewriteConfig(
@@ -217,10 +346,9 @@ def main() -> None:
         catalog_path_prefix=args.catalog_path_prefix.rstrip("/"),
     )
 
-    legacy_tokens = build_legacy_tokens()
-    legacy_token_res = [re.compile(re.escape(token), flags=re.IGNORECASE) for token in legacy_tokens]
+    legacy_re = build_legacy_re()
 
-    rewrite_directory(Path(args.input_dir), Path(args.output_dir), cfg, legacy_tokens, legacy_token_res)
+    rewrite_directory(Path(args.input_dir), Path(args.output_dir), cfg, legacy_re, workers=args.workers)
 
 
 if __name__ == "__main__":
@@ -11,19 +11,51 @@ from __future__ import annotations
 
 import argparse
 import csv
+import hashlib
 import json
 import re
 import sqlite3
 from collections import Counter, defaultdict
-from dataclasses import dataclass
+from contextlib import ExitStack
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any
 
+try:
+    import orjson
+except ImportError:  # Optional speedup; stdlib json is the fallback.
+    orjson = None
+
+try:
+    import xxhash
+except ImportError:  # Optional speedup; hashlib.blake2b is the fallback.
+    xxhash = None
+
 
 DEFAULT_IBIZ_DB = Path("/home/mlweb/Info-ibiz/ibiz2.sqlite3")
 IMPORTED_SOURCE_ID_PREFIX = "biznesinfo-"
 STRONG_EVIDENCE = {"direct_source_id", "phone", "email", "unp"}
+JSONL_BUFFER_SIZE = 8 * 1024 * 1024
+
+_WS_RE = re.compile(r"\s+")
+_HTTP_RE = re.compile(r"^https?://", flags=re.IGNORECASE)
+# Integers this long may not fit in 64 bits.
+_LONG_DIGITS_RE = re.compile(r"[0-9]{19}")
+_LONG_DIGITS_BYTES_RE = re.compile(rb"[0-9]{19}")
+
+
+class _DigitsOnlyTable(dict):
+    """`str.translate` table that keeps decimal digits (same set as regex `\\d`) and drops everything else."""
+
+    def __missing__(self, codepoint: int) -> str | None:
+        ch = chr(codepoint)
+        value = ch if ch.isdecimal() else None
+        self[codepoint] = value
+        return value
+
+
+_DIGITS_ONLY = _DigitsOnlyTable()
 
 
 def now_utc_compact() -> str:
@@ -31,15 +63,26 @@ def now_utc_compact() -> str:
 
 
 def norm_space(value: str) -> str:
-    return re.sub(r"\s+", " ", (value or "").strip())
+    return _WS_RE.sub(" ", (value or "").strip())
 
 
 def norm_text(value: str) -> str:
     return norm_space(value).casefold()
 
 
+def loads_json(raw: str | bytes) -> Any:
+    # orjson turns integers beyond 64 bits into floats, so lines with long digit runs go to stdlib.
+    long_digits_re = _LONG_DIGITS_BYTES_RE if isinstance(raw, bytes) else _LONG_DIGITS_RE
+    if orjson is not None and long_digits_re.search(raw) is None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass  # stdlib still accepts NaN/Infinity, which orjson rejects.
+    return json.loads(raw)
+
+
 def normalize_phone(raw: str) -> str:
-    return "".join(re.findall(r"\d+", raw or ""))
+    return (raw or "").translate(_DIGITS_ONLY)
 
 
 def normalize_email(raw: str) -> str:
@@ -47,7 +90,15 @@ def normalize_email(raw: str) -> str:
 
 
 def normalize_unp(raw: str) -> str:
-    return "".join(re.findall(r"\d+", raw or ""))
+    return (raw or "").translate(_DIGITS_ONLY)
+
+
+def name_addr_key(name_norm: str, address_norm: str) -> int:
+    # 64-bit digest instead of the concatenated text keeps the name+address index small.
+    data = f"{name_norm}||{address_norm}".encode("utf-8")
+    if xxhash is not None:
+        return xxhash.xxh64_intdigest(data)
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
 
 
 def uniq_keep_order(values: list[str]) -> list[str]:
@@ -73,7 +124,7 @@ def parse_json_list(raw: Any) -> list[str]:
     if not s:
         return []
     try:
-        value = json.loads(s)
+        value = loads_json(s)
     except Exception:
         return []
     if not isinstance(value, list):
@@ -89,7 +140,7 @@ def normalize_websites(values: list[str]) -> list[str]:
             continue
         if s.lower().startswith(("mailto:", "tel:")):
             continue
-        if not re.match(r"^https?://", s, flags=re.IGNORECASE):
+        if not _HTTP_RE.match(s):
             s = f"https://{s}"
         out.append(s)
     return uniq_keep_order(out)
@@ -104,15 +155,51 @@ def source_prefix(source_id: str) -> str:
     return "other"
 
 
-@dataclass(frozen=True)
-class IbizCompany:
-    subdomain: str
-    name: str
-    address: str
-    unp: str
-    phones: tuple[str, ...]
-    emails: tuple[str, ...]
-    websites: tuple[str, ...]
+@dataclass
+class IbizStore:
+    """iBiz companies stored column-wise: index `i` of every list describes the same company."""
+
+    subdomains: list[str] = field(default_factory=list)
+    names: list[str] = field(default_factory=list)
+    addresses: list[str] = field(default_factory=list)
+    unps: list[str] = field(default_factory=list)
+    phones: list[tuple[str, ...]] = field(default_factory=list)
+    emails: list[tuple[str, ...]] = field(default_factory=list)
+    websites: list[tuple[str, ...]] = field(default_factory=list)
+    subdomain_to_id: dict[str, int] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.subdomains)
+
+    def add(
+        self,
+        *,
+        subdomain: str,
+        name: str,
+        address: str,
+        unp: str,
+        phones: tuple[str, ...],
+        emails: tuple[str, ...],
+        websites: tuple[str, ...],
+    ) -> None:
+        company_id = self.subdomain_to_id.get(subdomain)
+        if company_id is not None:
+            # Later rows win for a repeated subdomain.
+            self.names[company_id] = name
+            self.addresses[company_id] = address
+            self.unps[company_id] = unp
+            self.phones[company_id] = phones
+            self.emails[company_id] = emails
+            self.websites[company_id] = websites
+            return
+        self.subdomain_to_id[subdomain] = len(self.subdomains)
+        self.subdomains.append(subdomain)
+        self.names.append(name)
+        self.addresses.append(address)
+        self.unps.append(unp)
+        self.phones.append(phones)
+        self.emails.append(emails)
+        self.websites.append(websites)
 
 
 @dataclass
@@ -126,109 +213,121 @@ class MatchDecision:
     auto_candidate: str | None
 
 
-def load_ibiz_companies(db_path: Path) -> dict[str, IbizCompany]:
+def load_ibiz_companies(db_path: Path) -> IbizStore:
+    out = IbizStore()
     conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
-    conn.row_factory = sqlite3.Row
     try:
+        # Stream rows off the cursor instead of materializing the whole result set.
         rows = conn.execute(
             """
             SELECT subdomain, name, address, unp, phones_json, emails_json, websites_json
             FROM companies
             WHERE status='done'
+              AND subdomain IS NOT NULL
+              AND TRIM(subdomain) <> ''
               AND websites_json IS NOT NULL
               AND TRIM(websites_json) NOT IN ('', '[]', 'null')
             """
-        ).fetchall()
+        )
+        for raw_subdomain, name, address, raw_unp, phones_json, emails_json, websites_json in rows:
+            subdomain = str(raw_subdomain or "").strip()
+            if not subdomain:
+                continue
+            websites = normalize_websites(parse_json_list(websites_json))
+            if not websites:
+                continue
+            phones = uniq_keep_order(
+                [p for p in (normalize_phone(x) for x in parse_json_list(phones_json)) if len(p) >= 9]
+            )
+            emails = uniq_keep_order([e for e in (normalize_email(x) for x in parse_json_list(emails_json)) if e])
+            unp = normalize_unp(str(raw_unp or ""))
+            out.add(
+                subdomain=subdomain,
+                name=norm_space(str(name or "")),
+                address=norm_space(str(address or "")),
+                unp=unp,
+                phones=tuple(phones),
+                emails=tuple(emails),
+                websites=tuple(websites),
+            )
     finally:
         conn.close()
-
-    out: dict[str, IbizCompany] = {}
-    for row in rows:
-        subdomain = str(row["subdomain"] or "").strip()
-        if not subdomain:
-            continue
-        websites = normalize_websites(parse_json_list(row["websites_json"]))
-        if not websites:
-            continue
-        phones = uniq_keep_order(
-            [p for p in (normalize_phone(x) for x in parse_json_list(row["phones_json"])) if len(p) >= 9]
-        )
-        emails = uniq_keep_order([e for e in (normalize_email(x) for x in parse_json_list(row["emails_json"])) if e])
-        unp = normalize_unp(str(row["unp"] or ""))
-        out[subdomain] = IbizCompany(
-            subdomain=subdomain,
-            name=norm_space(str(row["name"] or "")),
-            address=norm_space(str(row["address"] or "")),
-            unp=unp,
-            phones=tuple(phones),
-            emails=tuple(emails),
-            websites=tuple(websites),
-        )
     return out
 
 
+def _freeze_index(index: dict[Any, list[int]]) -> dict[Any, tuple[int, ...]]:
+    return {key: tuple(dict.fromkeys(ids)) for key, ids in index.items()}
+
+
 def build_ibiz_indexes(
-    companies: dict[str, IbizCompany],
-) -> tuple[dict[str, set[str]], dict[str, set[str]], dict[str, set[str]], dict[str, set[str]]]:
-    by_phone: dict[str, set[str]] = defaultdict(set)
-    by_email: dict[str, set[str]] = defaultdict(set)
-    by_unp: dict[str, set[str]] = defaultdict(set)
-    by_name_addr: dict[str, set[str]] = defaultdict(set)
-
-    for subdomain, company in companies.items():
-        for phone in company.phones:
-            by_phone[phone].add(subdomain)
-        for email in company.emails:
-            by_email[email].add(subdomain)
-        if len(company.unp) >= 6:
-            by_unp[company.unp].add(subdomain)
-        key = f"{norm_text(company.name)}||{norm_text(company.address)}"
-        if key != "||":
-            by_name_addr[key].add(subdomain)
-
-    return by_phone, by_email, by_unp, by_name_addr
+    companies: IbizStore,
+) -> tuple[dict[str, tuple[int, ...]], dict[str, tuple[int, ...]], dict[str, tuple[int, ...]], dict[int, tuple[int, ...]]]:
+    # Indexes are read-only once built, so ids are collected in lists and frozen to tuples
+    # rather than paying for a set object per key.
+    by_phone: dict[str, list[int]] = {}
+    by_email: dict[str, list[int]] = {}
+    by_unp: dict[str, list[int]] = {}
+    by_name_addr: dict[int, list[int]] = {}
+
+    for company_id in range(len(companies)):
+        for phone in companies.phones[company_id]:
+            by_phone.setdefault(phone, []).append(company_id)
+        for email in companies.emails[company_id]:
+            by_email.setdefault(email, []).append(company_id)
+        unp = companies.unps[company_id]
+        if len(unp) >= 6:
+            by_unp.setdefault(unp, []).append(company_id)
+        name_norm = norm_text(companies.names[company_id])
+        address_norm = norm_text(companies.addresses[company_id])
+        if name_norm or address_norm:
+            by_name_addr.setdefault(name_addr_key(name_norm, address_norm), []).append(company_id)
+
+    return _freeze_index(by_phone), _freeze_index(by_email), _freeze_index(by_unp), _freeze_index(by_name_addr)
 
 
 def collect_candidates(
     *,
     company: dict[str, Any],
-    ibiz_companies: dict[str, IbizCompany],
-    by_phone: dict[str, set[str]],
-    by_email: dict[str, set[str]],
-    by_unp: dict[str, set[str]],
-    by_name_addr: dict[str, set[str]],
+    ibiz_companies: IbizStore,
+    by_phone: dict[str, tuple[int, ...]],
+    by_email: dict[str, tuple[int, ...]],
+    by_unp: dict[str, tuple[int, ...]],
+    by_name_addr: dict[int, tuple[int, ...]],
 ) -> dict[str, set[str]]:
-    candidates: dict[str, set[str]] = defaultdict(set)
+    candidates: dict[int, set[str]] = defaultdict(set)
 
     source_id = str(company.get("source_id") or "").strip()
-    if source_id and source_id in ibiz_companies:
-        candidates[source_id].add("direct_source_id")
+    direct_id = ibiz_companies.subdomain_to_id.get(source_id) if source_id else None
+    if direct_id is not None:
+        candidates[direct_id].add("direct_source_id")
 
-    for raw_phone in company.get("phones") or []:
-        phone = normalize_phone(str(raw_phone))
+    # Normalize and dedupe query keys once; repeated phones/emails would only re-add the same evidence.
+    phones = dict.fromkeys(normalize_phone(str(p)) for p in company.get("phones") or [] if p)
+    for phone in phones:
         if len(phone) < 9:
             continue
-        for subdomain in by_phone.get(phone, set()):
-            candidates[subdomain].add("phone")
+        for company_id in by_phone.get(phone, ()):
+            candidates[company_id].add("phone")
 
-    for raw_email in company.get("emails") or []:
-        email = normalize_email(str(raw_email))
+    emails = dict.fromkeys(normalize_email(str(e)) for e in company.get("emails") or [] if e)
+    for email in emails:
         if not email:
             continue
-        for subdomain in by_email.get(email, set()):
-            candidates[subdomain].add("email")
+        for company_id in by_email.get(email, ()):
+            candidates[company_id].add("email")
 
     unp = normalize_unp(str(company.get("unp") or ""))
     if len(unp) >= 6:
-        for subdomain in by_unp.get(unp, set()):
-            candidates[subdomain].add("unp")
+        for company_id in by_unp.get(unp, ()):
+            candidates[company_id].add("unp")
 
-    name_addr_key = f"{norm_text(str(company.get('name') or ''))}||{norm_text(str(company.get('address') or ''))}"
-    if name_addr_key != "||":
-        for subdomain in by_name_addr.get(name_addr_key, set()):
-            candidates[subdomain].add("name_addr")
+    name_norm = norm_text(str(company.get("name") or ""))
+    address_norm = norm_text(str(company.get("address") or ""))
+    if name_norm or address_norm:
+        for company_id in by_name_addr.get(name_addr_key(name_norm, address_norm), ()):
+            candidates[company_id].add("name_addr")
 
-    return dict(candidates)
+    return {ibiz_companies.subdomains[company_id]: evidence for company_id, evidence in candidates.items()}
 
 
 def decide_match(
@@ -289,7 +388,7 @@ def write_report_csv(
     *,
     report_csv: Path,
     decisions: list[MatchDecision],
-    ibiz_companies: dict[str, IbizCompany],
+    ibiz_companies: IbizStore,
 ) -> None:
     report_csv.parent.mkdir(parents=True, exist_ok=True)
     with report_csv.open("w", encoding="utf-8", newline="") as f:
@@ -314,12 +413,12 @@ def write_report_csv(
                 continue
             for subdomain in sorted(decision.evidence_by_candidate.keys()):
                 ev = ",".join(sorted(decision.evidence_by_candidate[subdomain]))
-                candidate = ibiz_companies.get(subdomain)
-                if candidate:
-                    websites = " | ".join(candidate.websites)
-                    c_name = candidate.name
-                    c_addr = candidate.address
-                    c_unp = candidate.unp
+                candidate_id = ibiz_companies.subdomain_to_id.get(subdomain)
+                if candidate_id is not None:
+                    websites = " | ".join(ibiz_companies.websites[candidate_id])
+                    c_name = ibiz_companies.names[candidate_id]
+                    c_addr = ibiz_companies.addresses[candidate_id]
+                    c_unp = ibiz_companies.unps[candidate_id]
                 else:
                     websites = ""
                     c_name = ""
@@ -352,22 +451,24 @@ def apply_backfill(
     companies_jsonl: Path,
     backup: bool,
     auto_matches: dict[str, str],
-    ibiz_companies: dict[str, IbizCompany],
+    ibiz_companies: IbizStore,
 ) -> int:
-    if backup:
-        backup_path = companies_jsonl.with_suffix(f".backup-{now_utc_compact()}.jsonl")
-        backup_path.write_bytes(companies_jsonl.read_bytes())
-        print(f"Backup: {companies_jsonl} -> {backup_path}")
-
     updated = 0
     tmp_path = companies_jsonl.with_suffix(companies_jsonl.suffix + ".tmp")
-    with companies_jsonl.open("r", encoding="utf-8") as src, tmp_path.open("w", encoding="utf-8") as dst:
+    backup_path = companies_jsonl.with_suffix(f".backup-{now_utc_compact()}.jsonl") if backup else None
+    # Single read pass: the backup gets every original line byte-for-byte while the rewrite streams to tmp.
+    with ExitStack() as stack:
+        src = stack.enter_context(companies_jsonl.open("rb", buffering=JSONL_BUFFER_SIZE))
+        dst = stack.enter_context(tmp_path.open("w", encoding="utf-8", buffering=JSONL_BUFFER_SIZE))
+        backup_file = stack.enter_context(backup_path.open("wb", buffering=JSONL_BUFFER_SIZE)) if backup_path else None
         for line in src:
+            if backup_file:
+                backup_file.write(line)
             raw = line.strip()
             if not raw:
                 continue
             try:
-                obj = json.loads(raw)
+                obj = loads_json(raw)
             except Exception:
                 continue
 
@@ -375,13 +476,15 @@ def apply_backfill(
             current_websites = normalize_websites(obj.get("websites") or [])
             if source_id in auto_matches and not current_websites:
                 candidate_subdomain = auto_matches[source_id]
-                candidate = ibiz_companies.get(candidate_subdomain)
-                if candidate and candidate.websites:
-                    obj["websites"] = list(candidate.websites)
+                candidate_id = ibiz_companies.subdomain_to_id.get(candidate_subdomain)
+                if candidate_id is not None and ibiz_companies.websites[candidate_id]:
+                    obj["websites"] = list(ibiz_companies.websites[candidate_id])
                     updated += 1
 
             dst.write(json.dumps(obj, ensure_ascii=False) + "\n")
 
+    if backup_path:
+        print(f"Backup: {companies_jsonl} -> {backup_path}")
     tmp_path.replace(companies_jsonl)
     return updated
 
@@ -420,13 +523,13 @@ def main() -> int:
     source_prefix_counts: Counter[str] = Counter()
     decisions: list[MatchDecision] = []
 
-    with companies_jsonl.open("r", encoding="utf-8") as f:
+    with companies_jsonl.open("rb", buffering=JSONL_BUFFER_SIZE) as f:
         for line in f:
             raw = line.strip()
             if not raw:
                 continue
             try:
-                obj = json.loads(raw)
+                obj = loads_json(raw)
             except Exception:
                 continue
 